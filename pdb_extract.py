@@ -1,33 +1,69 @@
 """
 Simple command-line tool for fetching data from the RCSB Protein Data Bank.
 
-Uses the Protein Data Bank's REST API to retrieve data on PDB structures
-obtained with one of the experimental methods in EXP_METHODS.
+Uses the Protein Data Bank's Search API to find the PDB structures obtained
+with one of the experimental methods in EXP_METHODS, and its REST API to
+retrieve data on them.
 Each of REST API keys below corresponds to a column header in the output CSV.
 This is intended to be run automatically with cron, but can also be run
 manually (see help menu for usage).
 """
 
 import argparse
+import asyncio
 from collections import OrderedDict
 import csv
+import functools
+import gzip
+import hashlib
+import io
+import json
 import os, sys
 import pandas as pd
 import logging
-import urllib.request, urllib.error, urllib.parse
+import aiohttp
 import time
 import datetime
 
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
 DEFAULT_OUTPUT = 'PDB_extract-out.csv'
+# Output files with this extension are gzip-compressed
+GZIP_EXT = '.gz'
+# Favor speed over size when compressing output
+GZIP_LEVEL = 1
+# Directory for caching the fetched data of each PDB ID between runs
+CACHE_DIR = os.path.expanduser('~/.pdb_extract_cache')
+# Days before cached PDB data is fetched again, so later changes to an entry
+# (e.g. an added Pubmed ID) reach the output
+CACHE_MAX_AGE = 7
+SEARCH_URL = 'https://search.rcsb.org/rcsbsearch/v2/query'
 BASR_URL = 'http://www.rcsb.org/pdb/rest/'
-SEARCH_URL = BASR_URL + '/search'
 FETCH_URL_TEMPLATE = BASR_URL + (
     'customReport.csv?pdbids=%s&customReportColumns=%s'
     '&service=wsfile&format=csv')
+# Number of PDB IDs requested per customReport query
+FETCH_CHUNK_SIZE = 1000
+# Number of customReport queries in flight at once
+MAX_CONCURRENT_FETCHES = 32
+# Ask for compressed responses, which aiohttp decompresses transparently
+REQUEST_HEADERS = {'Accept-Encoding': 'gzip, deflate'}
+# Seconds allowed for a single query to the RCSB, including reading the
+# response
+REQUEST_TIMEOUT = 600
 
 logger = logging.getLogger('pdb_extract')
 logger.setLevel('INFO')
 
+# Keep the (mostly text) PDB data in Arrow arrays when pyarrow is available
+if pa is not None:
+    STRING_DTYPE = pd.StringDtype('pyarrow')
+else:
+    STRING_DTYPE = pd.StringDtype('python')
+
 # Keys corresponding to REST API fields we want data from
 PDB_ID_KEY = 'structureId'
 STRUCT_TITLE_KEY = 'structureTitle'
@@ -57,6 +93,10 @@ FIELDS_DICT = OrderedDict(
 
 FIELDS_LIST = ','.join(FIELDS_DICT)
 
+# Output columns with only a handful of distinct values, stored as categoricals
+CATEGORY_COLS = (FIELDS_DICT[CLASS_KEY], FIELDS_DICT[MACRO_TYPE_KEY],
+                 FIELDS_DICT[EXP_TECHNIQUE_KEY])
+
 # Valid experimental methods to search for PDB IDs
 EXP_METHODS = ('X-RAY', 'SOLUTION NMR', 'SOLID-STAE NMR',
                'ELECTRON MICROSCOPY', 'ELECTRON CRYSTALLOGRAPHY',
@@ -65,15 +105,22 @@ EXP_METHODS = ('X-RAY', 'SOLUTION NMR', 'SOLID-STAE NMR',
 
 DEFAULT_METHOD = EXP_METHODS[3]
 
-# Template for XML query to get PDB IDs list by experimental method
-XML_TEMPLATE = (
-    '<?xml version="1.0" encoding="UTF-8"?>'
-    '<orgPdbQuery>'
-    '<version>B0907</version>'
-    '<queryType>org.pdb.query.simple.ExpTypeQuery</queryType>'
-    '<description>Experimental Method Search: Experimental Method=%s</description>'
-    '<mvStructure.expMethod.value>%s</mvStructure.expMethod.value>'
-    '</orgPdbQuery>')
+# Search API attribute and value matching each experimental method
+EXP_METHOD_ATTRS = {
+    'X-RAY': ('exptl.method', 'X-RAY DIFFRACTION'),
+    'SOLUTION NMR': ('exptl.method', 'SOLUTION NMR'),
+    'SOLID-STAE NMR': ('exptl.method', 'SOLID-STATE NMR'),
+    'ELECTRON MICROSCOPY': ('exptl.method', 'ELECTRON MICROSCOPY'),
+    'ELECTRON CRYSTALLOGRAPHY': ('exptl.method', 'ELECTRON CRYSTALLOGRAPHY'),
+    'FIBER DIFFRACTION': ('exptl.method', 'FIBER DIFFRACTION'),
+    'NEUTRON DIFFRACTION': ('exptl.method', 'NEUTRON DIFFRACTION'),
+    'SOLUTION SCATTERING': ('exptl.method', 'SOLUTION SCATTERING'),
+    'OTHER': ('rcsb_entry_info.experimental_method', 'Other'),
+    'HYBRID': ('rcsb_entry_info.experimental_method', 'Multiple methods')
+}
+
+# Search API attribute for the resolution of a PDB structure
+RES_ATTR = 'rcsb_entry_info.resolution_combined'
 
 
 def parse_args():
@@ -90,7 +137,8 @@ def parse_args():
 
     parser.add_argument(
         '-outfile',
-        help='The name of the output CSV file',
+        help='The name of the output CSV file.  Use a *.csv.gz extension to '
+        'write gzip-compressed output',
         default=DEFAULT_OUTPUT)
 
     parser.add_argument(
@@ -110,85 +158,396 @@ def parse_args():
         'full format',
         action='store_true')
 
+    parser.add_argument(
+        '-cache_dir',
+        help='The directory for caching fetched PDB data between runs',
+        default=CACHE_DIR)
+
+    parser.add_argument(
+        '-cache_max_age',
+        help='The number of days before cached PDB data is fetched again',
+        type=float,
+        default=CACHE_MAX_AGE)
+
+    parser.add_argument(
+        '-no_cache',
+        help='Fetch the data for every PDB ID instead of reading previously '
+        'cached data',
+        action='store_true')
+
     args = parser.parse_args()
-    outfile_ext = os.path.splitext(args.outfile)[1]
-    if not outfile_ext == '.csv':
-        parser.error("Output file must have a *.csv extension (CSV format).")
+    if args.min_res is not None and args.min_res <= 0:
+        parser.error("Minimum resolution must be greater than 0 Angstroms.")
+    outfile_ext = split_outfile_ext(args.outfile)[1]
+    if outfile_ext not in ('.csv', '.csv' + GZIP_EXT):
+        parser.error("Output file must have a *.csv or *.csv.gz extension "
+                     "(CSV format).")
 
     return args
 
 
-def query_rcsb_db(url, data=None):
+def split_outfile_ext(outfile):
     """
-    Query RCSB database with the URL and return the response.
+    Split the output file name into its root and extension, keeping a
+    compressed extension together with the one before it (e.g. '.csv.gz').
+
+    @return: The root and extension of the file name
+    @rtype: tuple(str, str)
     """
 
-    request = urllib.request.Request(url, data=data)
+    outfile_root, outfile_ext = os.path.splitext(outfile)
+    if outfile_ext == GZIP_EXT:
+        outfile_root, inner_ext = os.path.splitext(outfile_root)
+        outfile_ext = inner_ext + outfile_ext
+
+    return outfile_root, outfile_ext
+
+
+def get_client_session():
+    """
+    Create a client session for querying the RCSB database.
+
+    @rtype: <aiohttp.ClientSession>
+    """
+
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    return aiohttp.ClientSession(headers=REQUEST_HEADERS, timeout=timeout)
+
+
+def run_rcsb_queries(coroutine):
+    """
+    Run the coroutine querying the RCSB database and return its result.  Exits
+    if any of the queries fail or time out.
+    """
 
     try:
-        response = urllib.request.urlopen(request)
-    except urllib.error.URLError as url_err:
-        logger.error(url_err)
+        return asyncio.run(coroutine)
+    except aiohttp.ClientError as client_err:
+        logger.error(client_err)
+        sys.exit(1)
+    except asyncio.TimeoutError:
+        logger.error("Query to the RCSB timed out after %i seconds" %
+                     REQUEST_TIMEOUT)
         sys.exit(1)
 
-    return response
+
+async def fetch_rcsb_db(url, query=None):
+    """
+    Fetch the response content for the URL from the RCSB database.  The
+    request is sent as a POST with the query as its JSON body if a query is
+    given, otherwise as a GET.
+
+    @return: The response body
+    @rtype: bytes
+    """
+
+    async with get_client_session() as session:
+        if query is None:
+            request = session.get(url, raise_for_status=True)
+        else:
+            request = session.post(url, json=query, raise_for_status=True)
+        async with request as response:
+            return await response.read()
+
+
+def query_rcsb_db(url, query=None):
+    """
+    Query RCSB database with the URL and return the response content.  The
+    request is sent as a POST with the query as its JSON body if a query is
+    given, otherwise as a GET.
+
+    @return: The response body
+    @rtype: bytes
+    """
+
+    return run_rcsb_queries(fetch_rcsb_db(url, query))
+
+
+async def fetch_rcsb_report(session, semaphore, url):
+    """
+    Fetch a single report from the RCSB database with the URL, waiting on the
+    semaphore so only a limited number of requests are in flight.
+
+    @return: The decoded response body
+    @rtype: str
+    """
+
+    async with semaphore:
+        async with session.get(url, raise_for_status=True) as response:
+            return await response.text(encoding='UTF-8')
 
 
-def get_pdbs_from_method(exp_method):
+async def fetch_rcsb_reports(urls):
+    """
+    Fetch the reports for all the URLs concurrently over one client session.
+
+    @return: The decoded response bodies, in the same order as the URLs
+    @rtype: list
+    """
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+    async with get_client_session() as session:
+        return await asyncio.gather(
+            *[fetch_rcsb_report(session, semaphore, url) for url in urls])
+
+
+def query_rcsb_reports(urls):
+    """
+    Query RCSB database with all the URLs and return the response contents.
+
+    @return: The decoded response bodies, in the same order as the URLs
+    @rtype: list
+    """
+
+    return run_rcsb_queries(fetch_rcsb_reports(urls))
+
+
+def get_search_query(exp_method, res_val=None):
+    """
+    Build the Search API query for PDB structures obtained with the given
+    experimental method.
+
+    @param res_val: If given, only match structures with a resolution at or
+    below this value (Angstroms)
+    @type res_val: float
+
+    @return: The JSON query
+    @rtype: dict
+    """
+
+    attribute, value = EXP_METHOD_ATTRS[exp_method]
+    nodes = [{
+        'type': 'terminal',
+        'service': 'text',
+        'parameters': {
+            'attribute': attribute,
+            'operator': 'exact_match',
+            'value': value
+        }
+    }]
+    if res_val is not None:
+        nodes.append({
+            'type': 'terminal',
+            'service': 'text',
+            'parameters': {
+                'attribute': RES_ATTR,
+                'operator': 'less_or_equal',
+                'value': res_val
+            }
+        })
+
+    return {
+        'query': {
+            'type': 'group',
+            'logical_operator': 'and',
+            'nodes': nodes
+        },
+        'return_type': 'entry',
+        'request_options': {
+            'return_all_hits': True
+        }
+    }
+
+
+def get_pdbs_from_method(exp_method, res_val=None):
     """
     Get the list of PDB IDs for the given experimental method.
 
+    @param res_val: If given, filter out PDB structures with a resolution
+    above this value (Angstroms)
+    @type res_val: float
+
     @return PDB ID list
     @rtype: list
     """
 
-    xml_str = XML_TEMPLATE % (exp_method, exp_method)
-    # logger.info("Getting PDB IDs for experimental method %s..." % exp_method)
-    pdb_ids_response = query_rcsb_db(SEARCH_URL, data=xml_str.encode('UTF-8'))
-    pdb_ids_str = pdb_ids_response.read()
-    # pdbs_list = pdb_ids_str.splitlines()
-    pdbs_list = [pdb.decode('UTF-8') for pdb in pdb_ids_str.splitlines()]
+    if res_val is not None:
+        logger.info(
+            "Filtering out PDB structures with resolution > %0.1f Angstroms" %
+            res_val)
+    search_query = get_search_query(exp_method, res_val)
+    search_str = query_rcsb_db(SEARCH_URL, query=search_query)
+    # The Search API returns no content when nothing matches the query
+    pdbs_list = []
+    if search_str:
+        search_results = json.loads(search_str)
+        pdbs_list = [hit['identifier'] for hit in search_results['result_set']]
     logger.info("Found %i PDB IDs for experimental method %s" %
                 (len(pdbs_list), exp_method))
 
     return pdbs_list
 
 
-def get_dataframe_from_pdbs(pdb_id_list, field_names):
+def read_cached_pdb_data(pdb_id_list, cache_dir, max_age):
+    """
+    Read the cached CSV data for the PDB IDs.
+
+    @param cache_dir: The cache directory for the requested fieldnames
+    @type cache_dir: str
+
+    @param max_age: The number of days after which cached data is stale
+    @type max_age: float
+
+    @return: The cached CSV data of each PDB ID, and the PDB IDs that have no
+    cached data or only stale cached data
+    @rtype: tuple(OrderedDict, list)
+    """
+
+    min_mtime = time.time() - max_age * 24 * 60 * 60
+    cached_data = OrderedDict()
+    missing_pdbs = []
+    for pdb_num in pdb_id_list:
+        cache_file = os.path.join(cache_dir, pdb_num + '.csv')
+        try:
+            is_fresh = os.path.getmtime(cache_file) >= min_mtime
+        except OSError:
+            is_fresh = False
+        if is_fresh:
+            with open(cache_file, encoding='UTF-8') as csv_file:
+                cached_data[pdb_num] = csv_file.read()
+        else:
+            missing_pdbs.append(pdb_num)
+
+    return cached_data, missing_pdbs
+
+
+def split_pdb_data(csv_str):
+    """
+    Split CSV data returned by the RCSB by PDB ID.
+
+    @param csv_str: CSV data returned by the RCSB for one or more PDB IDs
+    @type csv_str: str
+
+    @return: The CSV data of each PDB ID, each starting with the header row
+    @rtype: OrderedDict
+    """
+
+    reader = csv.reader(io.StringIO(csv_str))
+    # Skip any blank lines before the header
+    header = next((row for row in reader if row), None)
+    rows_by_pdb = OrderedDict()
+    if not header:
+        return rows_by_pdb
+
+    pdb_idx = header.index(PDB_ID_KEY)
+    for row in reader:
+        if row:
+            rows_by_pdb.setdefault(row[pdb_idx], []).append(row)
+
+    pdb_data = OrderedDict()
+    for pdb_num, rows in rows_by_pdb.items():
+        pdb_csv = io.StringIO()
+        writer = csv.writer(pdb_csv, lineterminator='\n')
+        writer.writerow(header)
+        writer.writerows(rows)
+        pdb_data[pdb_num] = pdb_csv.getvalue()
+
+    return pdb_data
+
+
+def cache_pdb_data(pdb_data, cache_dir):
+    """
+    Write the CSV data of each PDB ID to its own file in the cache directory.
+
+    @param pdb_data: The CSV data of each PDB ID, as returned by
+    split_pdb_data
+    @type pdb_data: dict
+
+    @param cache_dir: The cache directory for the requested fieldnames
+    @type cache_dir: str
+    """
+
+    os.makedirs(cache_dir, exist_ok=True)
+    for pdb_num, pdb_csv in pdb_data.items():
+        # Write to a temporary file first so an interrupted write never
+        # leaves a truncated cache file behind
+        cache_file = os.path.join(cache_dir, pdb_num + '.csv')
+        tmp_cache_file = cache_file + '.tmp'
+        with open(tmp_cache_file, 'w', encoding='UTF-8',
+                  newline='') as csv_file:
+            csv_file.write(pdb_csv)
+        os.replace(tmp_cache_file, cache_file)
+
+
+def get_dataframe_from_pdbs(pdb_id_list,
+                            field_names,
+                            cache_dir=None,
+                            cache_max_age=CACHE_MAX_AGE):
     """
     Create a pandas dataframe from with data returned by querying the RCSB with
     the PDB IDs list and fieldnames list.
 
+    @param cache_dir: Directory for caching the data of each PDB ID.  Only PDB
+    IDs without cached data are fetched from the RCSB.  If None, the data for
+    every PDB ID is fetched and nothing is cached.
+    @type cache_dir: str
+
+    @param cache_max_age: The number of days after which cached data is
+    fetched again
+    @type cache_max_age: float
+
     @return: The pandas dataframe
     @rtype: <pandas.core.frame.DataFrame>
     """
 
-    # Build data_str with PDB data
-    data_str = ''
-    logger.info("Fetching PDB data...")
-    for pdb_num in pdb_id_list:
-        fetch_url = FETCH_URL_TEMPLATE % (pdb_num, field_names)
-        pdb_data = query_rcsb_db(fetch_url).read()
-        pdb_data = pdb_data.decode('UTF-8')
-        data_str += pdb_data
-
-    # Build rows of PDB data for creating the DataFrame
-    data_rows = list(csv.reader(data_str.splitlines()))
+    pdb_data = OrderedDict()
+    fetch_pdbs = pdb_id_list
+    if cache_dir is not None:
+        # Keep a separate cache for each set of fieldnames
+        fields_hash = hashlib.sha1(field_names.encode('UTF-8')).hexdigest()
+        cache_dir = os.path.join(cache_dir, fields_hash)
+        pdb_data, fetch_pdbs = read_cached_pdb_data(
+            pdb_id_list, cache_dir, cache_max_age)
+        logger.info("Read cached data for %i PDB IDs" % len(pdb_data))
+
+    # Split the PDB IDs into chunks, one customReport query per chunk
+    chunks = [
+        fetch_pdbs[i:i + FETCH_CHUNK_SIZE]
+        for i in range(0, len(fetch_pdbs), FETCH_CHUNK_SIZE)
+    ]
+    urls = [
+        FETCH_URL_TEMPLATE % (','.join(chunk), field_names)
+        for chunk in chunks
+    ]
+    logger.info("Fetching data for %i PDB IDs..." % len(fetch_pdbs))
+    for report in query_rcsb_reports(urls):
+        report_data = split_pdb_data(report)
+        if cache_dir is not None:
+            cache_pdb_data(report_data, cache_dir)
+        pdb_data.update(report_data)
+
+    # Keep the rows in the order of the PDB IDs list, whether or not their
+    # data was cached, followed by any rows for IDs not in the list
+    csv_chunks = [
+        pdb_data.pop(pdb_num) for pdb_num in pdb_id_list
+        if pdb_num in pdb_data
+    ]
+    csv_chunks.extend(pdb_data.values())
+
+    # Build data_str with PDB data.  Every chunk starts with the same header
+    # row (the REST API keys), so keep it only for the first one.
+    if not csv_chunks:
+        raise Exception("The DataFrame object is empty.")
+    csv_chunks[1:] = [chunk.partition('\n')[2] for chunk in csv_chunks[1:]]
+    data_str = '\n'.join(csv_chunks)
 
-    # Create the DataFrame object
-    df = pd.DataFrame(data_rows)
+    # Create the DataFrame object.  Keep every column as text and leave blank
+    # entries as empty strings rather than NaN.  The pyarrow CSV engine isn't
+    # used as it infers column types before applying dtype, which mangles PDB
+    # IDs such as 1E10.
+    df = pd.read_csv(
+        io.StringIO(data_str), dtype=STRING_DTYPE, keep_default_na=False)
 
     if df.empty:
         raise Exception("The DataFrame object is empty.")
 
-    # Do some cleanup
-    df = df.drop_duplicates()
-    # Set column names to the REST API keys
-    df.columns = df.iloc[0]
-    # Slice off the first and last row (the first it's a duplicate of the column
-    # names and the last is blank)
-    df = df[1:-1]
+    # Do some cleanup.  Cast to categoricals first so removing the duplicates
+    # hashes their integer codes rather than the strings.
     df.rename(columns=FIELDS_DICT, inplace=True)
+    for col_nm in CATEGORY_COLS:
+        if col_nm in df:
+            df[col_nm] = df[col_nm].astype('category')
+    df = df.drop_duplicates()
 
     return df
 
@@ -203,14 +562,32 @@ def get_condensed_df(col_names, d_frame):
     @rtype: <pandas.core.frame.DataFrame>
     """
 
+    pdb_col = FIELDS_DICT[PDB_ID_KEY]
+    out_cols = d_frame.columns.drop('chainId')
+
     concat_df = concat_column_data(col_names, d_frame)
-    concat_df.drop('chainId', axis=1, inplace=True)
-    concat_df.reset_index(inplace=True, level=0, drop=True)
-    condensed_df = concat_df.drop_duplicates()
+    # Remove the duplicates in the remaining columns before joining the
+    # concatenated data back on
+    condensed_df = d_frame[out_cols.drop(col_names)].drop_duplicates()
+    condensed_df = condensed_df.join(concat_df, on=pdb_col)[out_cols]
+    condensed_df.reset_index(inplace=True, drop=True)
 
     return condensed_df
 
 
+def join_unique(col, join_char=' '):
+    """
+    Join the unique entries of the column, leaving out blank entries.
+
+    @param join_char: The string placed between entries
+    @type join_char: str
+
+    @rtype: str
+    """
+
+    return join_char.join([_f for _f in pd.unique(col) if _f])
+
+
 def concat_column_data(col_names, d_frame):
     """
     Concatenate unique column data in the dataframe for each identical PDB ID.
@@ -220,75 +597,81 @@ def concat_column_data(col_names, d_frame):
 
     @type col_names: List
 
-    @return:
+    @return: The concatenated data, with one row per PDB ID, indexed by PDB ID
 
     PDB ID | Column Name |             PDB ID | Column Name |
     ----------------------      -->    --------------------------
     1F6H   | Value_A                   1F6H   | Value_A Value_B
-    1F6H   | Value_B                   1F6H   | Value_A Value_B
+    1F6H   | Value_B
 
     @rtype: <pandas.core.frame.DataFrame>
     """
 
-    # Group by PDB first
-    grouped = d_frame.groupby(FIELDS_DICT[PDB_ID_KEY])
-    results = []
+    pdb_col = FIELDS_DICT[PDB_ID_KEY]
+    lig_col = FIELDS_DICT[LIG_NAME_KEY]
 
-    # FIXME: With the latest version of pandas, we could avoid having to
-    # iterate through each group.  We are currently using 0.14.0.
-    for name, grp in grouped:
-        for col_nm in col_names:
-            grp[col_nm] = grp[col_nm].astype(str)
-            unique_entries = list(grp[col_nm].unique())
-            join_char = ' '
-            if col_nm == FIELDS_DICT[LIG_NAME_KEY]:
-                join_char = ' | '
-            # Don't include blank entries in the replaced column
-            grp[col_nm] = join_char.join([_f for _f in unique_entries if _f])
-            results.append(grp)
+    # Cast the columns once up front rather than within every group, then
+    # group by PDB
+    grouped = d_frame[col_names].astype(STRING_DTYPE).groupby(
+        d_frame[pdb_col], sort=False)
 
-    concat_df = pd.concat(results)
+    aggregations = OrderedDict()
+    for col_nm in col_names:
+        join_char = ' '
+        if col_nm == lig_col:
+            join_char = ' | '
+        aggregations[col_nm] = functools.partial(
+            join_unique, join_char=join_char)
 
-    return concat_df
+    return grouped.agg(aggregations)
 
 
-def filter_by_res(d_frame, res_val, res_col_header):
+def write_csv(d_frame, outfile, columns=None):
     """
-    Filter the dataframe by resolution.
+    Write the dataframe to a CSV file, without the index.
 
-    @param res_val: The minimum resolution required to retain a row of data
-    @type: res_val: float
+    @param outfile: The name of the output CSV file.  The output is
+    gzip-compressed if it ends with GZIP_EXT.
+    @type outfile: str
 
-    @param res_col_header: The name of the column header containing the resolution
-    @type res_col_header: str
-
-    @return: The filtered DataFrame object
-    @rtype: <pandas.core.frame.DataFrame>
+    @param columns: The columns to write, in order.  All columns are written if
+    None.
+    @type columns: list
     """
 
-    d_frame[res_col_header] = pd.to_numeric(d_frame[res_col_header])
-    logger.info(
-        "Filtering out PDB structures with resolution > %0.1f Angstroms" %
-        res_val)
-    res_mask = d_frame[res_col_header] <= res_val
-    d_frame = d_frame[res_mask]
+    if outfile.endswith(GZIP_EXT):
+        out_stream = gzip.open(outfile, 'wb', compresslevel=GZIP_LEVEL)
+    else:
+        out_stream = open(outfile, 'wb')
+
+    with out_stream:
+        d_frame.to_csv(out_stream, index=False, columns=columns)
 
-    return d_frame
 
 def main():
     cmd_args = parse_args()
+    rel_date_col = FIELDS_DICT[REL_DATE_KEY]
+    pubmed_col = FIELDS_DICT[PUBMED_KEY]
+    lig_col = FIELDS_DICT[LIG_NAME_KEY]
+    source_col = FIELDS_DICT[SOURCE_KEY]
+    mac_type_col = FIELDS_DICT[MACRO_TYPE_KEY]
+    uniprot_col = FIELDS_DICT[UNIPROT_ID_KEY]
+
     # Get the list of PDB IDs
-    pdb_ids = get_pdbs_from_method(cmd_args.method)
+    pdb_ids = get_pdbs_from_method(cmd_args.method, cmd_args.min_res)
     fieldnames = FIELDS_LIST
     # Get the pandas dataframe
-    df = get_dataframe_from_pdbs(pdb_ids, fieldnames)
-
-    if cmd_args.min_res:
-        df = filter_by_res(df, cmd_args.min_res, FIELDS_DICT[RES_KEY])
+    cache_dir = None if cmd_args.no_cache else cmd_args.cache_dir
+    df = get_dataframe_from_pdbs(
+        pdb_ids,
+        fieldnames,
+        cache_dir=cache_dir,
+        cache_max_age=cmd_args.cache_max_age)
 
     # Write full output to CSV
-    tmp_outfile = os.path.splitext(cmd_args.outfile)[0] + '_tmp.csv'
-    df.to_csv(tmp_outfile, index=False)
+    outfile_root, outfile_ext = split_outfile_ext(cmd_args.outfile)
+    tmp_outfile = outfile_root + '_tmp' + outfile_ext
+    write_csv(df, tmp_outfile)
 
     # Check that output was written and contains data before overwriting the
     # previous CSV file
@@ -301,7 +684,9 @@ def main():
         logger.error("Output CSV %s is empty." % cmd_args.outfile)
         sys.exit(1)
 
-    most_recent_date = pd.to_datetime(df[FIELDS_DICT[REL_DATE_KEY]]).max()
+    # Release dates are ISO-8601 (YYYY-MM-DD) strings, so the lexicographic
+    # max is the most recent date and none of them need to be parsed
+    most_recent_date = df[rel_date_col].max()
     ts = time.time()
     timestamp = datetime.datetime.fromtimestamp(ts).strftime(
         '%Y-%m-%d %H:%M:%S')
@@ -314,12 +699,6 @@ def main():
 
     # Write condensed CSV output file
     if cmd_args.condensed:
-        pubmed_col = FIELDS_DICT[PUBMED_KEY]
-        lig_col = FIELDS_DICT[LIG_NAME_KEY]
-        source_col = FIELDS_DICT[SOURCE_KEY]
-        mac_type_col = FIELDS_DICT[MACRO_TYPE_KEY]
-        uniprot_col = FIELDS_DICT[UNIPROT_ID_KEY]
-
         cols_to_concat = [
             pubmed_col, lig_col, source_col, mac_type_col, uniprot_col
         ]
@@ -328,10 +707,9 @@ def main():
         logger.info("Writing condensed CSV output to %s" % out_name)
 
         # Move QED columns next to ligand columnds for final output.
-        export_cols = condensed_df.columns.tolist()[:-2]
-        qed_items = condensed_df.columns.tolist()[-2:]
-        export_cols[5:5] = qed_items
-        condensed_df.to_csv(out_name, index=False, columns=export_cols)
+        cols = condensed_df.columns.tolist()
+        export_cols = cols[:5] + cols[-2:] + cols[5:-2]
+        write_csv(condensed_df, out_name, columns=export_cols)
 
 
 if __name__ == '__main__':